@@ -2,7 +2,7 @@
 //! allows for efficient graph queries.
 
 use std::cmp::Ordering;
-use std::collections::HashMap;
+use std::collections::{HashMap, HashSet};
 use std::fmt::Debug;
 use std::future::Future;
 use std::sync::{Arc, Mutex};
@@ -399,22 +399,6 @@ impl Dag {
         &self.inner
     }
 
-    /// Determine whether or not the given commit is a public commit (i.e. is an
-    /// ancestor of the main branch).
-    #[instrument]
-    pub fn is_public_commit(&self, commit_oid: NonZeroOid) -> eyre::Result<bool> {
-        let main_branch_commits = self.commit_set_to_vec(&self.main_branch_commit)?;
-        for main_branch_commit in main_branch_commits {
-            if self.run_blocking(
-                self.inner
-                    .is_ancestor(commit_oid.into(), main_branch_commit.into()),
-            )? {
-                return Ok(true);
-            }
-        }
-        Ok(false)
-    }
-
     /// Wrapper around DAG method.
     #[instrument]
     pub fn query_is_ancestor(
@@ -459,9 +443,10 @@ impl Dag {
         Ok(result)
     }
 
-    /// Return the set of commits which are public, as per the definition in
-    /// `is_public_commit`. You should try to use `is_public_commit` instead, as
-    /// it will be faster to compute.
+    /// Return the set of commits which are public (i.e. are ancestors of the
+    /// main branch). The set is computed once and cached, and checking whether
+    /// a commit belongs to it is cheap, so to classify several commits,
+    /// intersect them with this set rather than querying each one separately.
     #[instrument]
     pub fn query_public_commits_slow(&self) -> eyre::Result<&CommitSet> {
         self.public_commits.get_or_try_init(|| {
@@ -678,33 +663,35 @@ impl Dag {
     /// containing `B, C` and another containing only `E`
     #[instrument]
     pub fn get_connected_components(&self, commit_set: &CommitSet) -> eyre::Result<Vec<CommitSet>> {
+        let commit_oids = self.commit_set_to_vec(commit_set)?;
+        let mut unvisited_oids: HashSet<NonZeroOid> = commit_oids.iter().copied().collect();
         let mut components: Vec<CommitSet> = Vec::new();
-        let mut component = CommitSet::empty();
-        let mut commits_to_connect = commit_set.clone();
-
-        // FIXME: O(n^2) algorithm (
-        // FMI see https://github.com/arxanas/git-branchless/pull/450#issuecomment-1188391763
-        for commit in self.commit_set_to_vec(commit_set)? {
-            if self.run_blocking(commits_to_connect.is_empty())? {
-                break;
-            }
 
-            if !self.run_blocking(commits_to_connect.contains(&commit.into()))? {
+        for commit_oid in commit_oids {
+            if !unvisited_oids.remove(&commit_oid) {
+                // Already part of a previously-found component.
                 continue;
             }
 
-            let mut commits = CommitSet::from(commit);
-            while !self.run_blocking(commits.is_empty())? {
-                component = component.union(&commits);
-                commits_to_connect = commits_to_connect.difference(&commits);
-
+            // Grow the component one layer at a time. Commits are removed from
+            // `unvisited_oids` as soon as they're reached, so each commit is
+            // expanded at most once, rather than repeatedly narrowing down an
+            // ever-deeper chain of lazy set differences.
+            let mut component_oids = vec![commit_oid];
+            let mut frontier_oids = vec![commit_oid];
+            while !frontier_oids.is_empty() {
+                let commits: CommitSet = frontier_oids.iter().copied().collect();
                 let parents = self.run_blocking(self.inner.parents(commits.clone()))?;
-                let children = self.run_blocking(self.inner.children(commits.clone()))?;
-                commits = parents.union(&children).intersection(&commits_to_connect);
+                let children = self.run_blocking(self.inner.children(commits))?;
+                frontier_oids = self
+                    .commit_set_to_vec(&parents.union(&children))?
+                    .into_iter()
+                    .filter(|oid| unvisited_oids.remove(oid))
+                    .collect();
+                component_oids.extend(frontier_oids.iter().copied());
             }
 
-            components.push(component);
-            component = CommitSet::empty();
+            components.push(component_oids.into_iter().collect());
         }
 
         let connected_commits = union_all(&components);
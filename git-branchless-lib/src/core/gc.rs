@@ -18,7 +18,7 @@ use crate::core::eventlog::{
     is_gc_ref, CommitActivityStatus, EventCursor, EventLogDb, EventReplayer,
 };
 use crate::core::formatting::Pluralize;
-use crate::git::{NonZeroOid, Reference, Repo};
+use crate::git::{NonZeroOid, Reference, ReferenceName, Repo};
 
 /// Find references under `refs/branchless/` which point to commits which are no
 /// longer active. These are safe to remove.
@@ -78,12 +78,24 @@ pub fn mark_commit_reachable(repo: &Repo, commit_oid: NonZeroOid) -> eyre::Resul
         format!("Invalid ref name to mark commit as reachable: {ref_name}")
     );
 
+    // Commands like `smartlog` mark the same commits as reachable on every
+    // invocation. If a previous invocation already created the reference,
+    // then there's nothing to do, so skip rewriting it.
+    let ref_name = ReferenceName::from(ref_name);
+    if let Some(reference) = repo.find_reference(&ref_name)? {
+        if let Some(commit) = reference.peel_to_commit()? {
+            if commit.get_oid() == commit_oid {
+                return Ok(());
+            }
+        }
+    }
+
     // NB: checking for the commit first with `find_commit` is racy, as the `create_reference` call
     // could still fail if the commit is deleted by then, but it's too hard to propagate whether the
     // commit was not found from `create_reference`.
     if repo.find_commit(commit_oid)?.is_some() {
         repo.create_reference(
-            &ref_name.into(),
+            &ref_name,
             commit_oid,
             true,
             "branchless: marking commit as reachable",
@@ -431,7 +431,14 @@ impl NodeDescriptor for DifferentialRevisionDescriptor<'_> {
             NodeObject::GarbageCollected { oid: _ } => return Ok(None),
         };
 
-        let diff_number = match extract_diff_number(&commit.get_message_raw().to_str_lossy()) {
+        // Most commits don't have a revision line at all, so check for one in
+        // the raw bytes before decoding the whole message and running the
+        // regex on it.
+        let message = commit.get_message_raw();
+        if !message.contains_str("Differential Revision: ") {
+            return Ok(None);
+        }
+        let diff_number = match extract_diff_number(&message.to_str_lossy()) {
             Some(diff_number) => diff_number,
             None => return Ok(None),
         };
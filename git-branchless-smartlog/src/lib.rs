@@ -44,12 +44,12 @@ pub use render::{render_graph, SmartlogOptions};
 use git_branchless_revset::resolve_commits;
 
 mod graph {
-    use std::collections::HashMap;
+    use std::collections::{HashMap, HashSet};
 
     use lib::core::gc::mark_commit_reachable;
     use tracing::instrument;
 
-    use lib::core::dag::{CommitSet, CommitVertex, Dag};
+    use lib::core::dag::{union_all, CommitSet, CommitVertex, Dag};
     use lib::core::effects::{Effects, OperationType};
     use lib::core::eventlog::{EventCursor, EventReplayer};
     use lib::core::node_descriptors::NodeObject;
@@ -165,39 +165,59 @@ mod graph {
         let commits_include_main =
             !dag.set_is_empty(&dag.main_branch_commit.intersection(commits))?;
         let mut graph: HashMap<NonZeroOid, Node> = {
+            // Gather the merge-bases for all of the commits up front, so that
+            // each commit is only looked up and added to the graph once, even
+            // if it's the merge-base of many of the other commits.
+            let merge_bases = if commits_include_main {
+                let mut merge_bases = Vec::new();
+                for vertex in dag.commit_set_to_vec(commits)? {
+                    let vertex = CommitSet::from(vertex);
+                    merge_bases.push(dag.query_gca_all(dag.main_branch_commit.union(&vertex))?);
+                }
+                union_all(&merge_bases)
+            } else {
+                // Every vertex is already in `commits`, so its merge-base with
+                // `commits` is the same for all of them.
+                dag.query_gca_all(commits.clone())?
+            };
+            let vertices = commits.union(&merge_bases);
+
+            // Classify all of the vertices at once, instead of querying the
+            // DAG separately for each node. Iterate from the vertices' side of
+            // each intersection, since they're much fewer than the public or
+            // obsolete commits.
+            let public_oids: HashSet<NonZeroOid> = dag
+                .commit_set_to_vec(&vertices.intersection(dag.query_public_commits_slow()?))?
+                .into_iter()
+                .collect();
+            let obsolete_oids: HashSet<NonZeroOid> = dag
+                .commit_set_to_vec(&vertices.intersection(&dag.query_obsolete_commits()))?
+                .into_iter()
+                .collect();
+
             let mut result = HashMap::new();
-            for vertex in dag.commit_set_to_vec(commits)? {
-                let vertex = CommitSet::from(vertex);
-                let merge_bases = if commits_include_main {
-                    dag.query_gca_all(dag.main_branch_commit.union(&vertex))?
-                } else {
-                    dag.query_gca_all(commits.union(&vertex))?
+            for oid in dag.commit_set_to_vec(&vertices)? {
+                let object = match repo.find_commit(oid)? {
+                    Some(commit) => NodeObject::Commit { commit },
+                    None => {
+                        // Assume that this commit was garbage collected.
+                        NodeObject::GarbageCollected { oid }
+                    }
                 };
-                let vertices = vertex.union(&merge_bases);
-
-                for oid in dag.commit_set_to_vec(&vertices)? {
-                    let object = match repo.find_commit(oid)? {
-                        Some(commit) => NodeObject::Commit { commit },
-                        None => {
-                            // Assume that this commit was garbage collected.
-                            NodeObject::GarbageCollected { oid }
-                        }
-                    };
-
-                    result.insert(
-                        oid,
-                        Node {
-                            object,
-                            parents: Vec::new(),  // populated below
-                            children: Vec::new(), // populated below
-                            ancestor_info: None,
-                            descendants: Vec::new(), // populated below
-                            is_main: dag.is_public_commit(oid)?,
-                            is_obsolete: dag.set_contains(&dag.query_obsolete_commits(), oid)?,
-                            num_omitted_descendants: 0, // populated below
-                        },
-                    );
-                }
+
+                result.insert(
+                    oid,
+                    Node {
+                        object,
+                        parents: Vec::new(),  // populated below
+                        children: Vec::new(), // populated below
+                        ancestor_info: None,
+                        descendants: Vec::new(), // populated below
+                        is_main: public_oids.contains(&oid),
+                        is_obsolete: obsolete_oids.contains(&oid),
+                        num_omitted_descendants: 0, // populated below
+                    },
+                );
             }
             result
         };
@@ -212,44 +232,59 @@ mod graph {
 
         let graph_vertices: CommitSet = graph.keys().cloned().collect();
         for child_oid in non_main_node_oids {
-            let parent_vertices = dag.query_parent_names(CommitVertex::from(*child_oid))?;
+            // Check graph membership against the node map's keys, which is a
+            // plain hash lookup, rather than querying the DAG for each parent.
+            let parent_oids = dag
+                .query_parent_names(CommitVertex::from(*child_oid))?
+                .into_iter()
+                .map(NonZeroOid::try_from)
+                .collect::<eyre::Result<Vec<_>>>()?;
 
             // Find immediate parent-child links.
-            match parent_vertices.as_slice() {
+            match parent_oids.as_slice() {
                 [] => {}
-                [first_parent_vertex, merge_parent_vertices @ ..] => {
-                    if dag.set_contains(&graph_vertices, first_parent_vertex.clone())? {
-                        let first_parent_oid = NonZeroOid::try_from(first_parent_vertex.clone())?;
-                        immediate_links.push((*child_oid, first_parent_oid, false));
+                [first_parent_oid, merge_parent_oids @ ..] => {
+                    if graph.contains_key(first_parent_oid) {
+                        immediate_links.push((*child_oid, *first_parent_oid, false));
                     }
-                    for merge_parent_vertex in merge_parent_vertices {
-                        if dag.set_contains(&graph_vertices, merge_parent_vertex.clone())? {
-                            let merge_parent_oid =
-                                NonZeroOid::try_from(merge_parent_vertex.clone())?;
-                            immediate_links.push((*child_oid, merge_parent_oid, true));
+                    for merge_parent_oid in merge_parent_oids {
+                        if graph.contains_key(merge_parent_oid) {
+                            immediate_links.push((*child_oid, *merge_parent_oid, true));
                         }
                     }
                 }
             }
 
             // Find non-immediate ancestor links.
-            for excluded_parent_vertex in parent_vertices {
-                if dag.set_contains(&graph_vertices, excluded_parent_vertex.clone())? {
+            for excluded_parent_oid in parent_oids {
+                if graph.contains_key(&excluded_parent_oid) {
                     continue;
                 }
 
                 // Find the nearest ancestor that is included in the graph and
                 // also on the same branch.
 
-                let parent_set = CommitSet::from(excluded_parent_vertex);
+                let parent_set = CommitSet::from(excluded_parent_oid);
                 let merge_base = dag.query_gca_one(dag.main_branch_commit.union(&parent_set))?;
 
                 let path_to_main_branch = match merge_base {
+                    // If the parent is itself on the main branch, then the path
+                    // consists of only the parent, which we already know isn't
+                    // in the graph, so there's no ancestor to link to.
+                    Some(merge_base) if merge_base == CommitVertex::from(excluded_parent_oid) => {
+                        continue;
+                    }
                     Some(merge_base) => dag.query_range(CommitSet::from(merge_base), parent_set)?,
-                    None => CommitSet::empty(),
+                    // Likewise, there's nothing to link to if the parent isn't
+                    // connected to the main branch at all.
+                    None => continue,
                 };
+                // Iterate from the graph side of the intersection: the graph
+                // only holds the handful of commits being rendered, whereas the
+                // path back to the main branch can be arbitrarily long, and
+                // the intersection visits every element of its left-hand side.
                 let nearest_branch_ancestor =
-                    dag.query_heads_ancestors(path_to_main_branch.intersection(&graph_vertices))?;
+                    dag.query_heads_ancestors(graph_vertices.intersection(&path_to_main_branch))?;
 
                 let ancestor_oids = dag.commit_set_to_vec(&nearest_branch_ancestor)?;
                 for ancestor_oid in ancestor_oids.iter() {
@@ -267,13 +302,16 @@ mod graph {
         }
 
         for (ancestor_oid, descendent_oid, is_merge_link) in non_immediate_links.iter() {
-            let distance = dag.set_count(
-                &dag.query_range(
+            // The range includes both endpoints, which are distinct since the
+            // ancestor was found among the ancestors of a parent of the
+            // descendant. Subtract them from the count, rather than building a
+            // new set to exclude them for every link.
+            let distance = dag
+                .set_count(&dag.query_range(
                     CommitSet::from(*ancestor_oid),
                     CommitSet::from(*descendent_oid),
-                )?
-                .difference(&vec![*ancestor_oid, *descendent_oid].into_iter().collect()),
-            )?;
+                )?)?
+                .saturating_sub(2);
             graph.get_mut(descendent_oid).unwrap().ancestor_info = Some(AncestorInfo {
                 oid: *ancestor_oid,
                 distance,
@@ -288,9 +326,15 @@ mod graph {
                 })
         }
 
+        // There are only a handful of main branch heads, so list them once and
+        // compare against them directly, rather than intersecting sets in the
+        // DAG for every node.
+        let main_branch_oids: HashSet<NonZeroOid> = dag
+            .commit_set_to_vec(&dag.main_branch_commit)?
+            .into_iter()
+            .collect();
         for (oid, node) in graph.iter_mut() {
-            let oid_set = CommitSet::from(*oid);
-            let is_main_head = !dag.set_is_empty(&dag.main_branch_commit.intersection(&oid_set))?;
+            let is_main_head = main_branch_oids.contains(oid);
             let ancestor_of_main = node.is_main && !is_main_head;
             let has_descendants_in_graph =
                 !node.children.is_empty() || !node.descendants.is_empty();
@@ -301,6 +345,7 @@ mod graph {
 
             // This node has no descendants in the graph, so it's a
             // false head if it has *any* visible descendants.
+            let oid_set = CommitSet::from(*oid);
             let descendants_not_in_graph =
                 dag.query_descendants(oid_set.clone())?.difference(&oid_set);
             let descendants_not_in_graph = dag.filter_visible_commits(descendants_not_in_graph)?;
@@ -328,11 +373,14 @@ mod graph {
             })
             .collect();
         for node in graph.nodes.values_mut() {
+            // NB: OIDs compare by their raw bytes, which gives the same order as
+            // comparing their hex strings, without allocating a string for each
+            // comparison.
             node.children.sort_by_key(
                 |ChildInfo {
                      oid,
                      is_merge_child,
-                 }| (&commit_times[oid], *is_merge_child, oid.to_string()),
+                 }| (&commit_times[oid], *is_merge_child, *oid),
             );
         }
     }
@@ -362,6 +410,10 @@ mod graph {
                     .union(&dag.main_branch_commit)
             };
 
+            // NB: this is intentionally not parallelized. A `Repo` can't be
+            // shared between threads, so each worker would need to open its own
+            // handle, which costs more than the (usually no-op) reference
+            // lookups being distributed.
             for oid in dag.commit_set_to_vec(&commits)? {
                 mark_commit_reachable(repo, oid)?;
             }
@@ -374,8 +426,7 @@ mod graph {
 }
 
 mod render {
-    use std::cmp::Ordering;
-    use std::collections::HashSet;
+    use std::collections::{HashMap, HashSet};
 
     use cursive_core::theme::{BaseColor, Effect};
     use cursive_core::utils::markup::StyledString;
@@ -385,8 +436,8 @@ mod render {
     use lib::core::effects::Effects;
     use lib::core::formatting::{set_effect, Pluralize};
     use lib::core::formatting::{Glyphs, StyledStringBuilder};
-    use lib::core::node_descriptors::{render_node_descriptors, NodeDescriptor};
-    use lib::git::{NonZeroOid, Repo};
+    use lib::core::node_descriptors::{render_node_descriptors, NodeDescriptor, NodeObject};
+    use lib::git::{NonZeroOid, Time};
 
     use git_branchless_opts::{ResolveRevsetOptions, Revset};
 
@@ -400,249 +451,349 @@ mod render {
     /// Returns the list such that the topologically-earlier subgraphs are first in
     /// the list (i.e. those that would be rendered at the bottom of the smartlog).
     fn split_commit_graph_by_roots(
-        repo: &Repo,
         dag: &Dag,
         graph: &SmartlogGraph,
-    ) -> Vec<NonZeroOid> {
-        let mut root_commit_oids: Vec<NonZeroOid> = graph
+    ) -> eyre::Result<Vec<NonZeroOid>> {
+        let root_commit_oids: Vec<NonZeroOid> = graph
             .nodes
             .iter()
             .filter(|(_oid, node)| node.parents.is_empty() && node.ancestor_info.is_none())
             .map(|(oid, _node)| oid)
             .copied()
             .collect();
+        let root_commits: CommitSet = root_commit_oids.iter().copied().collect();
+
+        // Find out which of the other roots are ancestors of each root using
+        // one DAG query per root, rather than calculating a merge-base for
+        // every pair of roots compared while sorting.
+        let mut root_ancestor_oids: HashMap<NonZeroOid, HashSet<NonZeroOid>> = HashMap::new();
+        for root_oid in root_commit_oids.iter() {
+            let ancestors =
+                root_commits.intersection(&dag.query_ancestors(CommitSet::from(*root_oid))?);
+            let ancestor_oids: HashSet<NonZeroOid> = dag
+                .commit_set_to_vec(&ancestors)?
+                .into_iter()
+                .filter(|ancestor_oid| ancestor_oid != root_oid)
+                .collect();
+            root_ancestor_oids.insert(*root_oid, ancestor_oids);
+        }
 
-        let compare = |lhs_oid: &NonZeroOid, rhs_oid: &NonZeroOid| -> Ordering {
-            let lhs_commit = repo.find_commit(*lhs_oid);
-            let rhs_commit = repo.find_commit(*rhs_oid);
+        // Roots which are not orderable topologically (pathological situation)
+        // are ordered by timestamp to produce a consistent and reasonable guess
+        // at the intended topological ordering.
+        //
+        // The graph already holds the commit objects, so use those rather than
+        // looking the commits up in the repository again.
+        let commit_times: HashMap<NonZeroOid, Option<Time>> = root_commit_oids
+            .iter()
+            .map(|root_oid| {
+                let commit_time = match &graph.nodes[root_oid].object {
+                    NodeObject::Commit { commit } => Some(commit.get_time()),
+                    NodeObject::GarbageCollected { oid: _ } => None,
+                };
+                (*root_oid, commit_time)
+            })
+            .collect();
+        let mut remaining_oids = root_commit_oids;
+        remaining_oids.sort_by(|lhs_oid, rhs_oid| {
+            (&commit_times[lhs_oid], lhs_oid).cmp(&(&commit_times[rhs_oid], rhs_oid))
+        });
 
-            let (lhs_commit, rhs_commit) = match (lhs_commit, rhs_commit) {
-                (Ok(Some(lhs_commit)), Ok(Some(rhs_commit))) => (lhs_commit, rhs_commit),
-                _ => return lhs_oid.cmp(rhs_oid),
-            };
+        // Repeatedly take the earliest root all of whose ancestor roots have
+        // already been taken.
+        let mut sorted_oids: Vec<NonZeroOid> = Vec::with_capacity(remaining_oids.len());
+        let mut sorted_oids_set: HashSet<NonZeroOid> = HashSet::new();
+        while !remaining_oids.is_empty() {
+            let next_idx = remaining_oids
+                .iter()
+                .position(|oid| root_ancestor_oids[oid].is_subset(&sorted_oids_set))
+                .unwrap_or(0);
+            let next_oid = remaining_oids.remove(next_idx);
+            sorted_oids.push(next_oid);
+            sorted_oids_set.insert(next_oid);
+        }
+        Ok(sorted_oids)
+    }
 
-            let merge_base_oid =
-                dag.query_gca_one(vec![*lhs_oid, *rhs_oid].into_iter().collect::<CommitSet>());
-            let merge_base_oid = match merge_base_oid {
-                Err(_) => return lhs_oid.cmp(rhs_oid),
-                Ok(None) => None,
-                Ok(Some(merge_base_oid)) => NonZeroOid::try_from(merge_base_oid).ok(),
-            };
+    /// A pending unit of work for `get_child_output`.
+    enum OutputTask<'a> {
+        /// Render the given node, then schedule its children.
+        Node {
+            oid: NonZeroOid,
+            last_child_line_char: Option<&'a str>,
+        },
 
-            match merge_base_oid {
-                // lhs was topologically first, so it should be sorted earlier in the list.
-                Some(merge_base_oid) if merge_base_oid == *lhs_oid => Ordering::Less,
-                Some(merge_base_oid) if merge_base_oid == *rhs_oid => Ordering::Greater,
-
-                // The commits were not orderable (pathlogical situation). Let's
-                // just order them by timestamp in that case to produce a consistent
-                // and reasonable guess at the intended topological ordering.
-                Some(_) | None => match lhs_commit.get_time().cmp(&rhs_commit.get_time()) {
-                    result @ Ordering::Less | result @ Ordering::Greater => result,
-                    Ordering::Equal => lhs_oid.cmp(rhs_oid),
-                },
-            }
-        };
+        /// Render the given merge child inline, without descending into it.
+        MergeChild { oid: NonZeroOid },
+
+        /// Emit a line which has already been rendered.
+        Line(StyledString),
+    }
+
+    fn with_prefix(prefix: &str, line: StyledString) -> StyledString {
+        if prefix.is_empty() {
+            line
+        } else {
+            StyledStringBuilder::new()
+                .append_plain(prefix)
+                .append(line)
+                .build()
+        }
+    }
+
+    /// Glyph combinations which are the same for every node in the graph, so
+    /// that they can be built once per render rather than for each line.
+    #[derive(Debug)]
+    struct GraphGlyphs<'a> {
+        glyphs: &'a Glyphs,
+        merge_line: String,
+        split_line: String,
+        line_prefix: String,
+        merge_marker: StyledString,
+    }
 
-        root_commit_oids.sort_by(compare);
-        root_commit_oids
+    impl<'a> GraphGlyphs<'a> {
+        fn new(glyphs: &'a Glyphs) -> Self {
+            Self {
+                glyphs,
+                merge_line: format!("{}{}", glyphs.line_with_offshoot, glyphs.merge),
+                split_line: format!("{}{}", glyphs.line_with_offshoot, glyphs.split),
+                line_prefix: format!("{} ", glyphs.line),
+                merge_marker: StyledString::styled(
+                    format!("{} (merge) ", glyphs.commit_merge),
+                    BaseColor::Blue.dark(),
+                ),
+            }
+        }
     }
 
     #[instrument(skip(commit_descriptors, graph))]
     fn get_child_output(
-        glyphs: &Glyphs,
+        graph_glyphs: &GraphGlyphs,
         graph: &SmartlogGraph,
-        root_oids: &[NonZeroOid],
+        root_oids: &HashSet<NonZeroOid>,
         commit_descriptors: &mut [&mut dyn NodeDescriptor],
         head_oid: Option<NonZeroOid>,
         current_oid: NonZeroOid,
         last_child_line_char: Option<&str>,
     ) -> eyre::Result<Vec<StyledString>> {
-        let current_node = &graph.nodes[&current_oid];
-        let is_head = Some(current_oid) == head_oid;
-
         let mut lines = vec![];
 
-        if let Some(AncestorInfo { oid: _, distance }) = current_node.ancestor_info {
-            lines.push(
-                StyledStringBuilder::new()
-                    .append_plain(glyphs.commit_omitted)
-                    .append_plain(" ")
-                    .append_styled(
-                        Pluralize {
-                            determiner: None,
-                            amount: distance,
-                            unit: ("omitted commit", "omitted commits"),
-                        }
-                        .to_string(),
-                        Effect::Dim,
-                    )
-                    .build(),
-            );
-            lines.push(StyledString::plain(glyphs.vertical_ellipsis));
-        };
-
-        if let [_, merge_parents @ ..] = current_node.parents.as_slice() {
-            if !merge_parents.is_empty() {
-                for merge_parent_oid in merge_parents {
-                    let merge_parent_node = &graph.nodes[merge_parent_oid];
-                    lines.push(
-                        StyledStringBuilder::new()
-                            .append_plain(last_child_line_char.unwrap_or(glyphs.line))
-                            .append_plain(" ")
-                            .append_styled(
-                                format!("{} (merge) ", glyphs.commit_merge),
-                                BaseColor::Blue.dark(),
-                            )
-                            .append(render_node_descriptors(
-                                glyphs,
-                                &merge_parent_node.object,
-                                commit_descriptors,
-                            )?)
-                            .build(),
-                    );
+        let GraphGlyphs {
+            glyphs,
+            merge_line,
+            split_line,
+            line_prefix,
+            merge_marker,
+        } = graph_glyphs;
+
+        // Walk the subtree using an explicit stack instead of recursing once
+        // per child. Each task carries the prefix accumulated from the nodes
+        // above it, so that every line is prefixed exactly once when it's
+        // emitted, rather than being rebuilt at each level on the way back up.
+        let mut stack = vec![(
+            String::new(),
+            OutputTask::Node {
+                oid: current_oid,
+                last_child_line_char,
+            },
+        )];
+        while let Some((prefix, task)) = stack.pop() {
+            let (current_oid, last_child_line_char) = match task {
+                OutputTask::Node {
+                    oid,
+                    last_child_line_char,
+                } => (oid, last_child_line_char),
+
+                OutputTask::MergeChild { oid } => {
+                    let line = StyledStringBuilder::new()
+                        .append(merge_marker.clone())
+                        .append(render_node_descriptors(
+                            glyphs,
+                            &graph.nodes[&oid].object,
+                            commit_descriptors,
+                        )?)
+                        .build();
+                    lines.push(with_prefix(&prefix, line));
+                    continue;
                 }
-                lines.push(StyledString::plain(format!(
-                    "{}{}",
-                    glyphs.line_with_offshoot, glyphs.merge,
-                )));
-            }
-        }
 
-        lines.push({
-            let cursor = match (current_node.is_main, current_node.is_obsolete, is_head) {
-                (false, false, false) => glyphs.commit_visible,
-                (false, false, true) => glyphs.commit_visible_head,
-                (false, true, false) => glyphs.commit_obsolete,
-                (false, true, true) => glyphs.commit_obsolete_head,
-                (true, false, false) => glyphs.commit_main,
-                (true, false, true) => glyphs.commit_main_head,
-                (true, true, false) => glyphs.commit_main_obsolete,
-                (true, true, true) => glyphs.commit_main_obsolete_head,
+                OutputTask::Line(line) => {
+                    lines.push(with_prefix(&prefix, line));
+                    continue;
+                }
             };
-            let text = render_node_descriptors(glyphs, &current_node.object, commit_descriptors)?;
-            let first_line = StyledStringBuilder::new()
-                .append_plain(cursor)
-                .append_plain(" ")
-                .append(text)
-                .build();
-            if is_head {
-                set_effect(first_line, Effect::Bold)
-            } else {
-                first_line
-            }
-        });
 
-        if current_node.num_omitted_descendants > 0 {
-            lines.push(StyledString::plain(glyphs.vertical_ellipsis));
-            lines.push(
-                StyledStringBuilder::new()
-                    .append_plain(glyphs.commit_omitted)
-                    .append_plain(" ")
-                    .append_styled(
-                        Pluralize {
-                            determiner: None,
-                            amount: current_node.num_omitted_descendants,
-                            unit: ("omitted descendant commit", "omitted descendant commits"),
-                        }
-                        .to_string(),
-                        Effect::Dim,
-                    )
-                    .build(),
-            );
-        };
+            let current_node = &graph.nodes[&current_oid];
+            let is_head = Some(current_oid) == head_oid;
 
-        let children: Vec<ChildInfo> = current_node
-            .children
-            .iter()
-            .filter(
-                |ChildInfo {
-                     oid,
-                     is_merge_child: _,
-                 }| graph.nodes.contains_key(oid),
-            )
-            .cloned()
-            .collect();
-        let descendants: HashSet<ChildInfo> = current_node
-            .descendants
-            .iter()
-            .filter(
-                |ChildInfo {
-                     oid,
-                     is_merge_child: _,
-                 }| graph.nodes.contains_key(oid),
-            )
-            .cloned()
-            .collect();
-        for (child_idx, child_info) in children.iter().chain(descendants.iter()).enumerate() {
-            let ChildInfo {
-                oid: child_oid,
-                is_merge_child,
-            } = child_info;
-            if root_oids.contains(child_oid) {
-                // Will be rendered by the parent.
-                continue;
-            }
-            if *is_merge_child {
-                // lines.push(StyledString::plain(format!(
-                //     "{}{}",
-                //     glyphs.line_with_offshoot, glyphs.split
-                // )));
-                lines.push(
+            if let Some(AncestorInfo { oid: _, distance }) = current_node.ancestor_info {
+                lines.push(with_prefix(
+                    &prefix,
                     StyledStringBuilder::new()
-                        // .append_plain(last_child_line_char.unwrap_or(glyphs.line))
-                        // .append_plain(" ")
+                        .append_plain(glyphs.commit_omitted)
+                        .append_plain(" ")
                         .append_styled(
-                            format!("{} (merge) ", glyphs.commit_merge),
-                            BaseColor::Blue.dark(),
+                            Pluralize {
+                                determiner: None,
+                                amount: distance,
+                                unit: ("omitted commit", "omitted commits"),
+                            }
+                            .to_string(),
+                            Effect::Dim,
                         )
-                        .append(render_node_descriptors(
-                            glyphs,
-                            &graph.nodes[child_oid].object,
-                            commit_descriptors,
-                        )?)
                         .build(),
-                );
-                continue;
+                ));
+                lines.push(with_prefix(
+                    &prefix,
+                    StyledString::plain(glyphs.vertical_ellipsis),
+                ));
+            };
+
+            if let [_, merge_parents @ ..] = current_node.parents.as_slice() {
+                if !merge_parents.is_empty() {
+                    for merge_parent_oid in merge_parents {
+                        let merge_parent_node = &graph.nodes[merge_parent_oid];
+                        lines.push(with_prefix(
+                            &prefix,
+                            StyledStringBuilder::new()
+                                .append_plain(last_child_line_char.unwrap_or(glyphs.line))
+                                .append_plain(" ")
+                                .append(merge_marker.clone())
+                                .append(render_node_descriptors(
+                                    glyphs,
+                                    &merge_parent_node.object,
+                                    commit_descriptors,
+                                )?)
+                                .build(),
+                        ));
+                    }
+                    lines.push(with_prefix(
+                        &prefix,
+                        StyledString::plain(merge_line.clone()),
+                    ));
+                }
             }
 
-            let is_last_child = child_idx == (children.len() + descendants.len()) - 1;
-            lines.push(StyledString::plain(
-                if !is_last_child || last_child_line_char.is_some() {
-                    format!("{}{}", glyphs.line_with_offshoot, glyphs.split)
-                } else if current_node.descendants.is_empty() {
-                    glyphs.line.to_string()
+            lines.push(with_prefix(&prefix, {
+                let cursor = match (current_node.is_main, current_node.is_obsolete, is_head) {
+                    (false, false, false) => glyphs.commit_visible,
+                    (false, false, true) => glyphs.commit_visible_head,
+                    (false, true, false) => glyphs.commit_obsolete,
+                    (false, true, true) => glyphs.commit_obsolete_head,
+                    (true, false, false) => glyphs.commit_main,
+                    (true, false, true) => glyphs.commit_main_head,
+                    (true, true, false) => glyphs.commit_main_obsolete,
+                    (true, true, true) => glyphs.commit_main_obsolete_head,
+                };
+                let text =
+                    render_node_descriptors(glyphs, &current_node.object, commit_descriptors)?;
+                let first_line = StyledStringBuilder::new()
+                    .append_plain(cursor)
+                    .append_plain(" ")
+                    .append(text)
+                    .build();
+                if is_head {
+                    set_effect(first_line, Effect::Bold)
                 } else {
-                    glyphs.vertical_ellipsis.to_string()
-                },
-            ));
+                    first_line
+                }
+            }));
+
+            if current_node.num_omitted_descendants > 0 {
+                lines.push(with_prefix(
+                    &prefix,
+                    StyledString::plain(glyphs.vertical_ellipsis),
+                ));
+                lines.push(with_prefix(
+                    &prefix,
+                    StyledStringBuilder::new()
+                        .append_plain(glyphs.commit_omitted)
+                        .append_plain(" ")
+                        .append_styled(
+                            Pluralize {
+                                determiner: None,
+                                amount: current_node.num_omitted_descendants,
+                                unit: ("omitted descendant commit", "omitted descendant commits"),
+                            }
+                            .to_string(),
+                            Effect::Dim,
+                        )
+                        .build(),
+                ));
+            };
 
-            let child_output = get_child_output(
-                glyphs,
-                graph,
-                root_oids,
-                commit_descriptors,
-                head_oid,
-                *child_oid,
-                None,
-            )?;
-            for child_line in child_output {
-                let line = if is_last_child {
+            // Borrow the child entries from the graph rather than cloning them
+            // for every node rendered.
+            let children: Vec<&ChildInfo> = current_node
+                .children
+                .iter()
+                .filter(
+                    |ChildInfo {
+                         oid,
+                         is_merge_child: _,
+                     }| graph.nodes.contains_key(oid),
+                )
+                .collect();
+            let descendants: HashSet<&ChildInfo> = current_node
+                .descendants
+                .iter()
+                .filter(
+                    |ChildInfo {
+                         oid,
+                         is_merge_child: _,
+                     }| graph.nodes.contains_key(oid),
+                )
+                .collect();
+
+            // Tasks for the children are collected in output order, and then
+            // pushed onto the stack in reverse so that they're popped in order.
+            let mut child_tasks = Vec::new();
+            for (child_idx, child_info) in children.iter().chain(descendants.iter()).enumerate() {
+                let ChildInfo {
+                    oid: child_oid,
+                    is_merge_child,
+                } = child_info;
+                if root_oids.contains(child_oid) {
+                    // Will be rendered by the parent.
+                    continue;
+                }
+                if *is_merge_child {
+                    child_tasks.push((prefix.clone(), OutputTask::MergeChild { oid: *child_oid }));
+                    continue;
+                }
+
+                let is_last_child = child_idx == (children.len() + descendants.len()) - 1;
+                child_tasks.push((
+                    prefix.clone(),
+                    OutputTask::Line(StyledString::plain(
+                        if !is_last_child || last_child_line_char.is_some() {
+                            split_line.clone()
+                        } else if current_node.descendants.is_empty() {
+                            glyphs.line.to_string()
+                        } else {
+                            glyphs.vertical_ellipsis.to_string()
+                        },
+                    )),
+                ));
+
+                let child_prefix = if is_last_child {
                     match last_child_line_char {
-                        Some(last_child_line_char) => StyledStringBuilder::new()
-                            .append_plain(format!("{last_child_line_char} "))
-                            .append(child_line)
-                            .build(),
-                        None => child_line,
+                        Some(last_child_line_char) => format!("{prefix}{last_child_line_char} "),
+                        None => prefix.clone(),
                     }
                 } else {
-                    StyledStringBuilder::new()
-                        .append_plain(format!("{} ", glyphs.line))
-                        .append(child_line)
-                        .build()
+                    format!("{prefix}{line_prefix}")
                 };
-                lines.push(line)
+                child_tasks.push((
+                    child_prefix,
+                    OutputTask::Node {
+                        oid: *child_oid,
+                        last_child_line_char: None,
+                    },
+                ));
             }
+            stack.extend(child_tasks.into_iter().rev());
         }
         Ok(lines)
     }
@@ -659,20 +810,36 @@ mod render {
     ) -> eyre::Result<Vec<StyledString>> {
         let mut lines = Vec::new();
 
+        // The parents of each root are consulted several times below (once to
+        // see if the root has any parents at all, and then again for each
+        // neighboring root), so look them up from the DAG only once.
+        let mut root_parent_oids: HashMap<NonZeroOid, Vec<NonZeroOid>> = HashMap::new();
+        for root_oid in root_oids {
+            let parent_oids = dag
+                .query_parent_names(*root_oid)?
+                .into_iter()
+                .map(NonZeroOid::try_from)
+                .collect::<eyre::Result<Vec<_>>>()?;
+            root_parent_oids.insert(*root_oid, parent_oids);
+        }
+
         // Determine if the provided OID has the provided parent OID as a parent.
         //
         // This returns `true` in strictly more cases than checking `graph`,
         // since there may be links between adjacent main branch commits which
         // are not reflected in `graph`.
-        let has_real_parent = |oid: NonZeroOid, parent_oid: NonZeroOid| -> eyre::Result<bool> {
-            let parents = dag.query_parents(CommitSet::from(oid))?;
-            let result = dag.set_contains(&parents, parent_oid)?;
-            Ok(result)
+        let has_real_parent = |oid: NonZeroOid, parent_oid: NonZeroOid| -> bool {
+            root_parent_oids[&oid].contains(&parent_oid)
         };
 
+        // Every child of every rendered node is checked against the roots, so
+        // make that a hash lookup rather than a scan of the list of roots.
+        let root_oid_set: HashSet<NonZeroOid> = root_oids.iter().copied().collect();
+        let graph_glyphs = GraphGlyphs::new(glyphs);
+
         for (root_idx, root_oid) in root_oids.iter().enumerate() {
-            if !dag.set_is_empty(&dag.query_parents(CommitSet::from(*root_oid))?)? {
-                let line = if root_idx > 0 && has_real_parent(*root_oid, root_oids[root_idx - 1])? {
+            if !root_parent_oids[root_oid].is_empty() {
+                let line = if root_idx > 0 && has_real_parent(*root_oid, root_oids[root_idx - 1]) {
                     StyledString::plain(glyphs.line.to_owned())
                 } else {
                     StyledString::plain(glyphs.vertical_ellipsis.to_owned())
@@ -687,7 +854,7 @@ mod render {
             let last_child_line_char = {
                 if root_idx == root_oids.len() - 1 {
                     None
-                } else if has_real_parent(root_oids[root_idx + 1], *root_oid)? {
+                } else if has_real_parent(root_oids[root_idx + 1], *root_oid) {
                     Some(glyphs.line)
                 } else {
                     Some(glyphs.vertical_ellipsis)
@@ -695,9 +862,9 @@ mod render {
             };
 
             let child_output = get_child_output(
-                glyphs,
+                &graph_glyphs,
                 graph,
-                root_oids,
+                &root_oid_set,
                 commit_descriptors,
                 head_oid,
                 *root_oid,
@@ -713,13 +880,12 @@ mod render {
     #[instrument(skip(commit_descriptors, graph))]
     pub fn render_graph(
         effects: &Effects,
-        repo: &Repo,
         dag: &Dag,
         graph: &SmartlogGraph,
         head_oid: Option<NonZeroOid>,
         commit_descriptors: &mut [&mut dyn NodeDescriptor],
     ) -> eyre::Result<Vec<StyledString>> {
-        let root_oids = split_commit_graph_by_roots(repo, dag, graph);
+        let root_oids = split_commit_graph_by_roots(dag, graph)?;
         let lines = get_output(
             effects.get_glyphs(),
             dag,
@@ -827,7 +993,6 @@ pub fn smartlog(
 
     let mut lines = render_graph(
         &effects.reverse_order(reverse),
-        &repo,
         &dag,
         &graph,
         references_snapshot.head_oid,
@@ -849,17 +1014,25 @@ pub fn smartlog(
         ],
     )?
     .into_iter();
+
+    // Reuse a single output stream for the graph and the hint lines below,
+    // rather than setting up (and tearing down) a new one for every write.
+    // (The shared hint suppression notice still writes through `effects`.)
+    let glyphs = effects.get_glyphs();
+    let mut output_stream = effects.get_output_stream();
+
+    // Render the whole graph into one buffer and write it out at once. Each
+    // write to the output stream takes a lock and flushes, so writing
+    // line-by-line is noticeably slower for large graphs.
+    let mut output = String::new();
     while let Some(line) = if reverse {
         lines.next_back()
     } else {
         lines.next()
     } {
-        writeln!(
-            effects.get_output_stream(),
-            "{}",
-            effects.get_glyphs().render(line)?
-        )?;
+        writeln!(output, "{}", glyphs.render(line)?)?;
     }
+    output_stream.write_str(&output)?;
 
     if !resolve_revset_options.show_hidden_commits
         && get_hint_enabled(&repo, Hint::SmartlogFixAbandoned)?
@@ -882,9 +1055,9 @@ pub fn smartlog(
             dag.set_count(&children.difference(&dag.query_obsolete_commits()))?;
         if num_abandoned_children > 0 {
             writeln!(
-                effects.get_output_stream(),
+                output_stream,
                 "{}: there {} in your commit graph",
-                effects.get_glyphs().render(get_hint_string())?,
+                glyphs.render(get_hint_string())?,
                 Pluralize {
                     determiner: Some(("is", "are")),
                     amount: num_abandoned_children,
@@ -892,9 +1065,9 @@ pub fn smartlog(
                 },
             )?;
             writeln!(
-                effects.get_output_stream(),
+                output_stream,
                 "{}: to fix this, run: git restack",
-                effects.get_glyphs().render(get_hint_string())?,
+                glyphs.render(get_hint_string())?,
             )?;
             print_hint_suppression_notice(effects, Hint::SmartlogFixAbandoned)?;
         }
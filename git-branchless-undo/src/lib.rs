@@ -88,7 +88,6 @@ fn render_cursor_smartlog(
     )?;
     let result = render_graph(
         effects,
-        repo,
         &dag,
         &graph,
         references_snapshot.head_oid,
@@ -144,7 +144,6 @@ fn describe_event_cursor(
     )?;
     let graph_lines = render_graph(
         &effects,
-        repo,
         dag,
         &graph,
         references_snapshot.head_oid,
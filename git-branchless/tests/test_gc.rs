@@ -1,7 +1,8 @@
 use itertools::Itertools;
 use lib::core::eventlog::testing::redact_event_timestamp;
 use lib::core::eventlog::EventLogDb;
-use lib::git::GitVersion;
+use lib::core::gc::mark_commit_reachable;
+use lib::git::{GitVersion, ReferenceName};
 use lib::testing::{make_git, GitInitOptions};
 
 #[test]
@@ -289,3 +290,50 @@ fn test_gc_no_init() -> eyre::Result<()> {
 
     Ok(())
 }
+
+#[test]
+fn test_mark_commit_reachable() -> eyre::Result<()> {
+    let git = make_git()?;
+    git.init_repo()?;
+    // Log updates to `refs/branchless` references too, so that we can tell
+    // whether a reference was rewritten.
+    git.run(&["config", "core.logAllRefUpdates", "always"])?;
+
+    let test1_oid = git.commit_file("test1", 1)?;
+    let test2_oid = git.commit_file("test2", 2)?;
+
+    let repo = git.get_repo()?;
+    let ref_name_str = format!("refs/branchless/{test1_oid}");
+    let ref_name = ReferenceName::from(ref_name_str.as_str());
+    let get_ref_target = || -> eyre::Result<_> {
+        let reference = repo.find_reference(&ref_name)?.unwrap();
+        Ok(reference.peel_to_commit()?.map(|commit| commit.get_oid()))
+    };
+    let count_reflog_entries = || -> eyre::Result<usize> {
+        let (stdout, _stderr) = git.run(&["reflog", "show", &ref_name_str])?;
+        Ok(stdout.lines().count())
+    };
+
+    // The post-commit hook has already marked the commit as reachable, so
+    // delete the reference (and its reflog) to exercise creating it.
+    git.run(&["update-ref", "-d", &ref_name_str])?;
+    assert!(repo.find_reference(&ref_name)?.is_none());
+
+    mark_commit_reachable(&repo, test1_oid)?;
+    assert_eq!(get_ref_target()?, Some(test1_oid));
+    assert_eq!(count_reflog_entries()?, 1);
+
+    // Marking the commit again should leave the existing reference in place.
+    mark_commit_reachable(&repo, test1_oid)?;
+    assert_eq!(get_ref_target()?, Some(test1_oid));
+    assert_eq!(count_reflog_entries()?, 1);
+
+    // A reference which points elsewhere should still be updated.
+    repo.create_reference(&ref_name, test2_oid, true, "test")?;
+    assert_eq!(get_ref_target()?, Some(test2_oid));
+    mark_commit_reachable(&repo, test1_oid)?;
+    assert_eq!(get_ref_target()?, Some(test1_oid));
+    assert_eq!(count_reflog_entries()?, 3);
+
+    Ok(())
+}